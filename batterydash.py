@@ -1,10 +1,17 @@
+import functools
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 import requests
+import orjson
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime
 from plotly.subplots import make_subplots
+from requests.adapters import HTTPAdapter
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from urllib3.util.retry import Retry
 
 # Page configuration
 st.set_page_config(
@@ -115,6 +122,22 @@ class BatteryAPI:
     def __init__(self, base_url: str):
         self.base_url = base_url.rstrip('/')
         self.session = requests.Session()
+        # Pooled keep-alive connections plus retries so dashboard reloads
+        # don't redo TLS handshakes or fail on transient 5xx responses
+        retry = Retry(
+            total=3,
+            backoff_factor=0.2,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET'])
+        )
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Connection': 'keep-alive',
+            'Accept': 'application/json'
+        })
     
     @st.cache_data(ttl=300)
     def get_summary(_self):
@@ -123,7 +146,7 @@ class BatteryAPI:
         try:
             response = _self.session.get(url)
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
         except Exception as e:
             st.error(f"Error fetching summary: {e}")
             return {}
@@ -136,28 +159,230 @@ class BatteryAPI:
         try:
             response = _self.session.get(url, params=params)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             return data if isinstance(data, list) else data.get('snapshots', data.get('data', []))
         except Exception as e:
             st.error(f"Error fetching snapshots: {e}")
             return []
 
+    @st.cache_data(ttl=300)
+    def get_cycle_details(_self, imei: str, cycle_number: int):
+        """Get detailed analytics for a specific cycle"""
+        url = f"{_self.base_url}/api/snapshots/{imei}/cycles/{cycle_number}"
+        try:
+            response = _self.session.get(url)
+            response.raise_for_status()
+            return orjson.loads(response.content)
+        except Exception:
+            return {}
+
+@st.cache_resource
+def _get_prefetch_pool() -> ThreadPoolExecutor:
+    """Background pool for speculative fetches, shared across reruns
+
+    The script re-executes top to bottom on every interaction, so a bare
+    module-level executor would be recreated (and orphaned) per rerun;
+    cache_resource gives it the same session lifetime as the API client.
+    Two workers cover the previous/next cycle prefetch without competing
+    with the main thread.
+    """
+    return ThreadPoolExecutor(max_workers=2)
+
+def _prefetch_cycle_details(api, imei: str, cycle_number):
+    """Warm get_cycle_details' cache from a background thread
+
+    The current script-run context is attached to the worker so the
+    st.cache_data call stores its result (and doesn't log a missing
+    ScriptRunContext warning) off the main thread.
+    """
+    ctx = get_script_run_ctx()
+
+    def task():
+        add_script_run_ctx(ctx=ctx)
+        api.get_cycle_details(imei, cycle_number)
+
+    _get_prefetch_pool().submit(task)
+
+BASE_URL = "https://zenfinity-intern-api-104290304048.europe-west1.run.app"
+AUTHORIZED_IMEIS = ["865044073967657", "865044073949366"]
+
+@st.cache_resource
+def get_api() -> BatteryAPI:
+    """Singleton API client so the connection pool survives reruns"""
+    return BatteryAPI(BASE_URL)
+
+TEMP_RANGES = ('5deg', '10deg', '15deg', '20deg')
+
+def _build_temp_fig(temp_dist):
+    """Bar chart of time per temperature range, or None if all zero"""
+    if not temp_dist:
+        return None
+
+    # One vectorized pass: convert, test and filter on the array instead
+    # of separate Python loops for any(), to_numeric and the > 0 filter
+    minutes = np.fromiter(
+        (float(v) for v in temp_dist.values()),
+        dtype=np.float32, count=len(temp_dist)
+    )
+    mask = minutes > 0
+    if not mask.any():
+        return None
+
+    ranges = np.asarray(list(temp_dist), dtype=object)[mask]
+    minutes = minutes[mask]
+    fig = px.bar(x=ranges, y=minutes,
+                 title='Time in Temperature Ranges',
+                 color=minutes, color_continuous_scale='RdYlBu_r',
+                 labels={'x': 'Range', 'y': 'Minutes', 'color': 'Minutes'})
+    fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
+                      font=dict(color='white'), height=400)
+    return fig
+
+@st.cache_data(ttl=300)
+def build_temp_figs(imei: str, cycle_number, _snapshot):
+    """Build the figures for all four sampling rates in one cached pass
+
+    All four distributions already live in the snapshot, so toggling the
+    sampling-rate radio becomes a dict lookup instead of a rebuild.
+    Keyed on (imei, cycle_number); the snapshot itself is not hashed.
+    """
+    return {
+        r: _build_temp_fig(_snapshot.get(f'temperature_dist_{r}') or {})
+        for r in TEMP_RANGES
+    }
+
+@st.cache_data(ttl=300)
+def make_soc_gauge(value: float) -> dict:
+    """SOC gauge figure as a dict, cached on the primitive value"""
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        title={'text': "Avg SOC", 'font': {'color': 'white'}},
+        gauge={'axis': {'range': [0, 100]}, 'bar': {'color': "lightgreen"}}
+    ))
+    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', font={'color': 'white'}, height=250)
+    return fig.to_dict()
+
+@st.cache_data(ttl=300)
+def make_soh_gauge(value: float) -> dict:
+    """SOH gauge figure as a dict, cached on the primitive value"""
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=value,
+        title={'text': "Avg SOH", 'font': {'color': 'white'}},
+        gauge={'axis': {'range': [90, 100]}, 'bar': {'color': "cyan"}}
+    ))
+    fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', font={'color': 'white'}, height=250)
+    return fig.to_dict()
+
+@st.cache_data(ttl=300)
+def make_efficiency_fig(imei: str, n: int, last_cycle, _df_trends, _soc_consumed, _distance) -> dict:
+    """Distance-vs-SOC scatter as a dict, keyed on (imei, n, last_cycle)
+
+    The underscore arguments carry the data but are not hashed; the key
+    identifies the snapshot history they were derived from.
+    """
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=_soc_consumed,
+        y=_distance,
+        mode='markers',
+        marker=dict(
+            size=_df_trends['cycle_duration_hours'].clip(upper=50) / 2,
+            color=_df_trends['average_temperature'],
+            colorscale='RdYlBu_r',
+            showscale=True,
+            colorbar=dict(
+                title=dict(text="Temp (°C)", font=dict(color="white")),
+                tickfont=dict(color="white")
+            ),
+            line=dict(width=1, color='white')
+        ),
+        text=[f"Cycle {c}" for c in _df_trends['cycle_number']],
+        hovertemplate='<b>Cycle %{text}</b><br>SOC Used: %{x:.1f}%<br>Distance: %{y:.2f} km<extra></extra>'
+    ))
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white', size=11),
+        xaxis_title='SOC Consumed (%)',
+        yaxis_title='Distance Traveled (km)',
+        height=400
+    )
+    return fig.to_dict()
+
+@st.cache_data(ttl=300)
+def make_voltage_stability_fig(imei: str, n: int, last_cycle, _df_trends, _voltage_range) -> dict:
+    """Voltage range trend as a dict, keyed on (imei, n, last_cycle)"""
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        x=_df_trends['cycle_number'],
+        y=_voltage_range,
+        mode='lines+markers',
+        line=dict(color='#06b6d4', width=2),
+        marker=dict(size=5, color='#06b6d4'),
+        fill='tozeroy',
+        name='Voltage Range'
+    ))
+
+    avg_range = float(_voltage_range.mean())
+    fig.add_hline(
+        y=avg_range,
+        line_dash="dash",
+        line_color="#fbbf24",
+        annotation_text=f"Avg: {avg_range:.2f}V",
+        annotation_position="right",
+        annotation_font_color="white"
+    )
+
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white', size=11),
+        xaxis_title='Cycle Number',
+        yaxis_title='Voltage Range (V)',
+        height=400,
+        showlegend=False
+    )
+    return fig.to_dict()
+
+@st.cache_data(ttl=300)
+def trend_aggregates(imei: str, n: int, last_cycle, _df_trends) -> dict:
+    """Summary statistics for the trend section, keyed like the figures
+
+    The snapshots are immutable per cycle, so slider-only reruns get the
+    aggregates from cache instead of re-reducing the DataFrame.
+    """
+    return {
+        'n': n,
+        'avg_temp': float(_df_trends['average_temperature'].mean()),
+        'total_distance': float(_df_trends['total_distance'].sum())
+    }
+
+# Snapshot fields the trend section actually reads; building df_trends
+# from just these skips pandas type inference over the unused ones
+TREND_SCHEMA = (
+    'cycle_number', 'max_soc', 'min_soc', 'total_distance',
+    'voltage_max', 'voltage_min', 'average_temperature',
+    'cycle_duration_hours'
+)
+
+@functools.lru_cache(maxsize=4096)
 def format_datetime(dt_str):
-    """Format datetime string for display"""
+    """Format datetime string for display (memoized; reruns repeat inputs)"""
     if dt_str and dt_str != 'N/A':
+        iso = dt_str[:-1] + '+00:00' if dt_str.endswith('Z') else dt_str
         try:
-            dt = datetime.fromisoformat(dt_str.replace('Z', '+00:00'))
+            dt = datetime.fromisoformat(iso)
             return dt.strftime('%Y-%m-%d %H:%M')
         except:
             return dt_str
     return 'N/A'
 
 def main():
-    BASE_URL = "https://zenfinity-intern-api-104290304048.europe-west1.run.app"
-    AUTHORIZED_IMEIS = ["865044073967657", "865044073949366"]
-    
-    # Initialize API
-    api = BatteryAPI(BASE_URL)
+    # Reuse the cached client: a fresh BatteryAPI per rerun would discard
+    # the warm urllib3 pool and redo TCP + TLS setup on the next miss
+    api = get_api()
     
     # Sidebar
     with st.sidebar:
@@ -221,7 +446,14 @@ def main():
             cycle_idx = cycle_numbers.index(selected)
     
     snapshot = snapshots[cycle_idx]
-    
+
+    # Prefetch the neighbouring cycles' details in the background: they
+    # are the most likely next slider selections, so the next rerun hits
+    # the 5-minute cache instead of paying a round trip
+    for neighbour in (cycle_idx - 1, cycle_idx + 1):
+        if 0 <= neighbour < len(snapshots):
+            _prefetch_cycle_details(api, selected_imei, cycle_numbers[neighbour])
+
     # 2. CYCLE STATISTICS
     st.markdown("---")
     st.markdown("## 📈 Cycle Statistics")
@@ -235,6 +467,15 @@ def main():
         st.metric("Start Time", format_datetime(snapshot.get('cycle_start_time')))
     with col4:
         st.metric("End Time", format_datetime(snapshot.get('cycle_end_time')))
+
+    # Served from the cache warmed by the neighbouring-cycle prefetch,
+    # so stepping the slider renders this without a round trip
+    with st.expander("🔍 Detailed Cycle Analytics"):
+        details = api.get_cycle_details(selected_imei, snapshot.get('cycle_number', cycle_idx))
+        if details:
+            st.json(details)
+        else:
+            st.info("No detailed analytics available for this cycle")
     
     # 3. PERFORMANCE METRICS
     st.markdown("---")
@@ -261,26 +502,17 @@ def main():
     with col1:
         temp_range = st.radio(
             "Sampling Rate",
-            ['5deg', '10deg', '15deg', '20deg'],
+            list(TEMP_RANGES),
             format_func=lambda x: f"±{x.replace('deg', '°C')}",
             horizontal=True
         )
     with col2:
         st.metric("Avg Temp", f"{snapshot.get('average_temperature', 0):.1f}°C")
     
-    dist_key = f'temperature_dist_{temp_range}'
-    temp_dist = snapshot.get(dist_key, {})
-    
-    if temp_dist and any(v > 0 for v in temp_dist.values()):
-        df_temp = pd.DataFrame(list(temp_dist.items()), columns=['Range', 'Minutes'])
-        df_temp['Minutes'] = pd.to_numeric(df_temp['Minutes'])
-        df_temp = df_temp[df_temp['Minutes'] > 0]
-        
-        fig = px.bar(df_temp, x='Range', y='Minutes',
-                     title='Time in Temperature Ranges',
-                     color='Minutes', color_continuous_scale='RdYlBu_r')
-        fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
-                         font=dict(color='white'), height=400)
+    temp_figs = build_temp_figs(selected_imei, snapshot.get('cycle_number', cycle_idx), snapshot)
+    fig = temp_figs[temp_range]
+
+    if fig is not None:
         st.plotly_chart(fig, use_container_width=True)
     else:
         st.info("No temperature distribution data")
@@ -301,14 +533,8 @@ def main():
         with c3:
             st.metric("Max SOC", f"{snapshot.get('max_soc', 0):.1f}%")
         
-        fig_soc = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=snapshot.get('average_soc', 0),
-            title={'text': "Avg SOC", 'font': {'color': 'white'}},
-            gauge={'axis': {'range': [0, 100]}, 'bar': {'color': "lightgreen"}}
-        ))
-        fig_soc.update_layout(paper_bgcolor='rgba(0,0,0,0)', font={'color': 'white'}, height=250)
-        st.plotly_chart(fig_soc, use_container_width=True)
+        st.plotly_chart(go.Figure(make_soc_gauge(snapshot.get('average_soc', 0))),
+                        use_container_width=True)
     
     with col2:
         st.markdown("### State of Health (SOH)")
@@ -321,14 +547,8 @@ def main():
         with c3:
             st.metric("Min SOH", f"{snapshot.get('min_soh', 100):.2f}%")
         
-        fig_soh = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=snapshot.get('average_soh', 100),
-            title={'text': "Avg SOH", 'font': {'color': 'white'}},
-            gauge={'axis': {'range': [90, 100]}, 'bar': {'color': "cyan"}}
-        ))
-        fig_soh.update_layout(paper_bgcolor='rgba(0,0,0,0)', font={'color': 'white'}, height=250)
-        st.plotly_chart(fig_soh, use_container_width=True)
+        st.plotly_chart(go.Figure(make_soh_gauge(snapshot.get('average_soh', 100))),
+                        use_container_width=True)
     
     # Voltage/Current
     st.markdown("### ⚡ Electrical Parameters")
@@ -383,7 +603,19 @@ def main():
     st.markdown("---")
     st.markdown("## 📊 Long-term Trends & Advanced Analysis")
     
-    df_trends = pd.DataFrame(snapshots)
+    # Column-wise construction: one list per schema field instead of
+    # letting pandas type-probe every key of every snapshot dict
+    df_trends = pd.DataFrame(
+        {field: [s.get(field) for s in snapshots] for field in TREND_SCHEMA},
+        copy=False
+    )
+
+    # float32 is plenty of precision for SOC/voltage/temperature and
+    # halves the memory the trend math has to stream through
+    float_cols = df_trends.select_dtypes('float64').columns
+    df_trends[float_cols] = df_trends[float_cols].astype('float32', copy=False)
+    if df_trends['cycle_number'].notna().all():
+        df_trends['cycle_number'] = df_trends['cycle_number'].astype('int32', copy=False)
     
     if not df_trends.empty and len(df_trends) > 1:
         
@@ -391,108 +623,59 @@ def main():
         
         # Energy Efficiency Analysis
         st.markdown("### ⚡ Energy Efficiency & Performance Analysis")
-        
+
+        # Pull the trend columns into NumPy once and do the arithmetic on
+        # plain arrays instead of allocating a pandas Series per operation
+        max_soc, min_soc, distance, voltage_max, voltage_min = df_trends[
+            ['max_soc', 'min_soc', 'total_distance', 'voltage_max', 'voltage_min']
+        ].to_numpy(dtype=np.float32).T
+
+        soc_consumed = max_soc - min_soc
+        # Energy efficiency proxy (distance per SOC used), guarding division by zero
+        efficiency = distance / np.where(soc_consumed == 0, 1, soc_consumed)
+        efficiency = np.nan_to_num(efficiency, posinf=0.0, neginf=0.0)
+        voltage_range = voltage_max - voltage_min
+
         col1, col2 = st.columns(2)
-        
+
+        # Cache key: the figures only change when the history grows
+        n_cycles = len(df_trends)
+        last_cycle = df_trends['cycle_number'].iloc[-1]
+
         with col1:
             st.markdown("**Distance vs Energy Consumption Pattern**")
-            
-            # Calculate energy efficiency proxy (distance per SOC used)
-            soc_consumed = df_trends['max_soc'] - df_trends['min_soc']
-            # Avoid division by zero
-            efficiency = df_trends['total_distance'] / soc_consumed.replace(0, 1)
-            efficiency = efficiency.replace([float('inf'), -float('inf')], 0)
-            
-            fig_efficiency = go.Figure()
-            
-            # Scatter plot with size representing cycle duration
-            fig_efficiency.add_trace(go.Scatter(
-                x=soc_consumed,
-                y=df_trends['total_distance'],
-                mode='markers',
-                marker=dict(
-                    size=df_trends['cycle_duration_hours'].clip(upper=50) / 2,
-                    color=df_trends['average_temperature'],
-                    colorscale='RdYlBu_r',
-                    showscale=True,
-                    colorbar=dict(
-                        title=dict(text="Temp (°C)", font=dict(color="white")),
-                        tickfont=dict(color="white")
-                    ),
-                     line=dict(width=1, color='white')
-                ),
-
-                text=[f"Cycle {c}" for c in df_trends['cycle_number']],
-                hovertemplate='<b>Cycle %{text}</b><br>SOC Used: %{x:.1f}%<br>Distance: %{y:.2f} km<extra></extra>'
-            ))
-            
-            fig_efficiency.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='white', size=11),
-                xaxis_title='SOC Consumed (%)',
-                yaxis_title='Distance Traveled (km)',
-                height=400
+
+            fig_efficiency = make_efficiency_fig(
+                selected_imei, n_cycles, last_cycle,
+                df_trends, soc_consumed, distance
             )
-            
-            st.plotly_chart(fig_efficiency, use_container_width=True)
-            
+            st.plotly_chart(go.Figure(fig_efficiency), use_container_width=True)
+
             st.caption("💡 Bubble size = cycle duration, Color = temperature")
-        
+
         with col2:
             st.markdown("**Voltage Stability Analysis**")
-            
-            # Voltage range per cycle (max - min)
-            voltage_range = df_trends['voltage_max'] - df_trends['voltage_min']
-            
-            fig_voltage_stability = go.Figure()
-            
-            # Line chart with filled area
-            fig_voltage_stability.add_trace(go.Scatter(
-                x=df_trends['cycle_number'],
-                y=voltage_range,
-                mode='lines+markers',
-                line=dict(color='#06b6d4', width=2),
-                marker=dict(size=5, color='#06b6d4'),
-                fill='tozeroy',
-                name='Voltage Range'
-            ))
-            
-            # Add average line
-            avg_range = voltage_range.mean()
-            fig_voltage_stability.add_hline(
-                y=avg_range, 
-                line_dash="dash", 
-                line_color="#fbbf24",
-                annotation_text=f"Avg: {avg_range:.2f}V",
-                annotation_position="right",
-                annotation_font_color="white"
-            )
-            
-            fig_voltage_stability.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                font=dict(color='white', size=11),
-                xaxis_title='Cycle Number',
-                yaxis_title='Voltage Range (V)',
-                height=400,
-                showlegend=False
+
+            fig_voltage_stability = make_voltage_stability_fig(
+                selected_imei, n_cycles, last_cycle,
+                df_trends, voltage_range
             )
-            
-            st.plotly_chart(fig_voltage_stability, use_container_width=True)
-            
+            st.plotly_chart(go.Figure(fig_voltage_stability), use_container_width=True)
+
             st.caption("📊 Lower variance = better cell balance & health")
         
         # Summary Statistics
         st.markdown("### Summary Statistics")
         col1, col2, col3 = st.columns(3)
-        
+
+        aggregates = trend_aggregates(selected_imei, n_cycles, last_cycle, df_trends)
+
         with col1:
-            st.metric("Total Cycles", len(df_trends))
+            st.metric("Total Cycles", aggregates['n'])
         with col2:
-            st.metric("Avg Temperature", f"{df_trends['average_temperature'].mean():.1f}°C")
+            st.metric("Avg Temperature", f"{aggregates['avg_temp']:.1f}°C")
         with col3:
-            st.metric("Total Distance", f"{df_trends['total_distance'].sum():.2f} km")
+            st.metric("Total Distance", f"{aggregates['total_distance']:.2f} km")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file